@@ -1,10 +1,13 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
+from importlib.util import find_spec
 HERE = Path(__file__).parent
 
 st.set_page_config(page_title="Country Profile Dashboard", page_icon="📊", layout="wide", initial_sidebar_state="expanded")
@@ -29,19 +32,101 @@ st.markdown(
 
 # ------------------ Helpers ------------------
 
-@st.cache_data
+CATEGORY_COLS = ("origin_country", "dest_country", "ip_type", "direction", "jurisdiction", "filer")
+INT_COLS = ("year", "applications", "filings", "requests", "female_inventors", "male_inventors")
+
 def load_csv(uploaded_file, fallback_path=None):
+    # pyarrow parses on multiple threads; columns stay NumPy-backed for the conversions below
+    if uploaded_file is not None:
+        df = pd.read_csv(uploaded_file, engine="pyarrow")
+    elif fallback_path is not None:
+        df = pd.read_csv(fallback_path, engine="pyarrow")
+    else:
+        return pd.DataFrame()
+    # Low-cardinality label columns are masked/grouped on every rerun; categories compare on int codes
+    for col in CATEGORY_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    # Years and counts fit in int16/int32; narrower columns mean less memory traffic per filter pass
+    for col in INT_COLS:
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
+
+def source_id(name, uploaded_file):
+    """Identifies a dataset's current source; changes whenever a new file is uploaded."""
+    return f"{name}:{uploaded_file.file_id if uploaded_file is not None else 'sample'}"
+
+def parquet_bytes(df):
+    buf = BytesIO()
+    df.to_parquet(buf, compression="zstd")
+    return buf.getvalue()
+
+@st.cache_data(max_entries=8)
+def sample_parquet(path):
+    """The bundled sample files are parsed once per process, not once per session."""
+    return parquet_bytes(load_csv(None, path))
+
+def session_frame(key):
+    return pd.read_parquet(BytesIO(st.session_state[key]))
+
+def load_dataset(name, uploaded_file, fallback_path):
+    """Keep the dataset's Parquet bytes in session state and return their key; frames are decoded by cached consumers."""
+    key = f"parquet:{source_id(name, uploaded_file)}"
+    if key in st.session_state:
+        return key
+    # A new upload (or clearing one) changes the source; drop the bytes kept for the previous one
+    for stale in [k for k in st.session_state if k.startswith(f"parquet:{name}:")]:
+        del st.session_state[stale]
     if uploaded_file is not None:
-        return pd.read_csv(uploaded_file)
-    if fallback_path is not None:
-        return pd.read_csv(fallback_path)
-    return pd.DataFrame()
+        st.session_state[key] = parquet_bytes(load_csv(uploaded_file))
+    else:
+        st.session_state[key] = sample_parquet(fallback_path)
+    return key
+
+LINE_MAX_POINTS = 2000
+TABLE_MAX_ROWS = 200
+
+# numba is optional; the JIT only beats the Cython reducers on large frames (the first call pays compile time)
+HAS_NUMBA = find_spec("numba") is not None
+NUMBA_MIN_ROWS = 1_000_000
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: positions of n_out points that keep the visual shape of (x, y)."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # First and last points are kept; the interior is split into n_out-2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    out = np.empty(n_out, dtype=int)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nhi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[hi:nhi].mean(), y[hi:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+def downsample_lines(df, x, y, by, n_out=LINE_MAX_POINTS):
+    """Apply LTTB to every line (group of `by`) longer than n_out points; shorter lines pass through untouched."""
+    if len(df) <= n_out:
+        return df
+    parts = []
+    for _, g in df.groupby(by, observed=True, sort=False):
+        if len(g) > n_out:
+            g = g.sort_values(x)
+            g = g.iloc[lttb_indices(g[x].to_numpy(dtype=float), g[y].to_numpy(dtype=float), n_out)]
+        parts.append(g)
+    return pd.concat(parts)
 
 def fmt_int(x):
-    try:
-        return f"{int(x):,}"
-    except Exception:
-        return "—"
+    return f"{x:,.0f}" if pd.notna(x) else "—"
+
+def fmt_pct(x):
+    return f"{x:+.1f}%" if pd.notna(x) else "—"
 
 # ------------------ Sidebar ------------------
 st.sidebar.title("⚙️ Controls")
@@ -75,51 +160,61 @@ importance_csv = st.sidebar.file_uploader(
 )
 
 # ------------------ Load Data ------------------
-flows      = load_csv(flows_csv,      HERE / "sample_data" / "flows.csv")
-topfilers  = load_csv(topfilers_csv,  HERE / "sample_data" / "top_filers.csv")
-gender     = load_csv(gender_csv,     HERE / "sample_data" / "gender_split.csv")
-pph        = load_csv(pph_csv,        HERE / "sample_data" / "pph.csv")
-importance = load_csv(importance_csv, HERE / "sample_data" / "importance.csv")
-
-
-all_countries = sorted(set(flows["origin_country"]).union(set(flows["dest_country"])))
+flows_key      = load_dataset("flows",      flows_csv,      HERE / "sample_data" / "flows.csv")
+topfilers_key  = load_dataset("topfilers",  topfilers_csv,  HERE / "sample_data" / "top_filers.csv")
+gender_key     = load_dataset("gender",     gender_csv,     HERE / "sample_data" / "gender_split.csv")
+pph_key        = load_dataset("pph",        pph_csv,        HERE / "sample_data" / "pph.csv")
+importance_key = load_dataset("importance", importance_csv, HERE / "sample_data" / "importance.csv")
+
+
+# Sidebar choices and year bounds depend only on the raw flows frame, not on any widget
+@st.cache_data(max_entries=8)
+def derive_options(df_key):
+    df = session_frame(df_key)
+    countries = sorted(set(df["origin_country"]).union(set(df["dest_country"])))
+    if df.empty:
+        return countries, [], True, (2019, 2024)
+    ip_types = sorted(df["ip_type"].dropna().unique().tolist())
+    return countries, ip_types, False, (int(df["year"].min()), int(df["year"].max()))
+
+all_countries, ip_options, flows_empty, (min_year, max_year) = derive_options(flows_key)
 default_pair = ("Canada", "Japan") if {"Canada","Japan"}.issubset(all_countries) else (all_countries[0], all_countries[min(1, len(all_countries)-1)])
 
 c1 = st.sidebar.selectbox("Origin country", all_countries, index=all_countries.index(default_pair[0]) if default_pair[0] in all_countries else 0)
 c2 = st.sidebar.selectbox("Destination country", all_countries, index=all_countries.index(default_pair[1]) if default_pair[1] in all_countries else 1)
 
-ip_options = sorted(flows["ip_type"].dropna().unique().tolist()) if not flows.empty else []
 selected_ip = st.sidebar.multiselect("IP types", ip_options, default=ip_options)
 
-if flows.empty:
+if flows_empty:
     st.warning("No data found. Using built-in samples. Upload your CSVs in the left sidebar to replace them.")
 else:
     st.success("Loaded your data.")
 
 # Year range
-if not flows.empty:
-    min_year = int(flows["year"].min())
-    max_year = int(flows["year"].max())
-else:
-    min_year, max_year = 2019, 2024
 yr_from, yr_to = st.sidebar.slider("Year range", min_value=min_year, max_value=max_year, value=(min_year, max_year))
 
-# Filters applied
-def apply_filters(df, ip_types=None, year_min=None, year_max=None):
+# Filters applied (cached per dataset key + filter values, so unrelated widget changes hit the cache)
+@st.cache_data(max_entries=32)
+def apply_filters(df_key, ip_types=None, year_min=None, year_max=None):
+    df = session_frame(df_key)
     if df is None or df.empty:
         return df
-    out = df.copy()
-    if "year" in out.columns and year_min is not None and year_max is not None:
-        out = out[(out["year"] >= year_min) & (out["year"] <= year_max)]
-    if ip_types and "ip_type" in out.columns:
-        out = out[out["ip_type"].isin(ip_types)]
-    return out
-
-flows_f = apply_filters(flows, selected_ip, yr_from, yr_to)
-topfilers_f = apply_filters(topfilers, selected_ip, yr_from, yr_to)
-gender_f = apply_filters(gender, None, yr_from, yr_to)
-pph_f = apply_filters(pph, None, yr_from, yr_to)
-importance_f = apply_filters(importance, None, yr_from, yr_to)
+    # Combine conditions as numpy arrays and index once; boolean indexing already returns a new frame
+    mask = np.ones(len(df), dtype=bool)
+    if "year" in df.columns and year_min is not None and year_max is not None:
+        years = df["year"].to_numpy()
+        mask &= (years >= year_min) & (years <= year_max)
+    if ip_types and "ip_type" in df.columns:
+        mask &= df["ip_type"].isin(ip_types).to_numpy()
+    return df[mask]
+
+ip_filter = tuple(sorted(selected_ip))  # order-insensitive cache key
+flows_f = apply_filters(flows_key, ip_filter, yr_from, yr_to)
+
+# Serialized once per filter signature; the download button needs the bytes up front on every rerun
+@st.cache_data(max_entries=8)
+def filtered_csv(df_key, ip_types=None, year_min=None, year_max=None):
+    return apply_filters(df_key, ip_types, year_min, year_max).to_csv(index=False).encode("utf-8")
 
 # ------------------ Header ------------------
 st.markdown('<div class="sticky">', unsafe_allow_html=True)
@@ -130,7 +225,7 @@ with title_col1:
 with title_col2:
     st.write("")
     st.write("")
-    st.download_button("⬇️ Download filtered flows CSV", data=flows_f.to_csv(index=False), file_name="flows_filtered.csv", mime="text/csv")
+    st.download_button("⬇️ Download filtered flows CSV", data=filtered_csv(flows_key, ip_filter, yr_from, yr_to), file_name="flows_filtered.csv", mime="text/csv")
 st.markdown('</div>', unsafe_allow_html=True)
 
 # ------------------ KPIs ------------------
@@ -139,139 +234,238 @@ def kpi_card(container, title, value):
     with container:
         st.markdown(f'<div class="kpi"><h3>{title}</h3><div class="value">{value}</div></div>', unsafe_allow_html=True)
 
-# Compute totals
-def sum_apps(df, o, d):
-    if df.empty: return 0
-    mask = (df["origin_country"]==o) & (df["dest_country"]==d)
-    return int(df.loc[mask, "applications"].sum())
+# Compute totals: aggregate (origin, dest, year) once, then the KPIs are index lookups
+def pair_year_totals(df):
+    if df.empty: return pd.Series(dtype="int64")
+    grouped = df.groupby(["origin_country","dest_country","year"], observed=True)["applications"]
+    if HAS_NUMBA and len(df) >= NUMBA_MIN_ROWS:
+        return grouped.sum(engine="numba", engine_kwargs={"nopython": True, "nogil": True})
+    return grouped.sum()
+
+agg = pair_year_totals(flows_f)
 
-total_o_to_d = sum_apps(flows_f, c1, c2)
-total_d_to_o = sum_apps(flows_f, c2, c1)
+def sum_apps(agg, o, d):
+    if agg.empty or (o, d) not in agg.index.droplevel("year"): return 0
+    return int(agg.loc[(o, d)].sum())
 
-def yoy_change(df, o, d, end_year):
-    if df.empty: return None
-    df2 = df[(df["origin_country"]==o) & (df["dest_country"]==d)].groupby("year")["applications"].sum().sort_index()
-    if end_year not in df2.index or (end_year-1) not in df2.index: return None
-    prev = df2.loc[end_year-1]
+total_o_to_d = sum_apps(agg, c1, c2)
+total_d_to_o = sum_apps(agg, c2, c1)
+
+def yoy_change(agg, o, d, end_year):
+    prev = agg.get((o, d, end_year-1))
+    cur = agg.get((o, d, end_year))
+    if prev is None or cur is None: return None
     if prev == 0: return None
-    return 100*(df2.loc[end_year]-prev)/prev
+    return 100*(cur-prev)/prev
 
-yoy_o_to_d = yoy_change(flows_f, c1, c2, yr_to)
-yoy_d_to_o = yoy_change(flows_f, c2, c1, yr_to)
+yoy_o_to_d = yoy_change(agg, c1, c2, yr_to)
+yoy_d_to_o = yoy_change(agg, c2, c1, yr_to)
 
 kpi_card(k1, f"{c1} → {c2} applications", fmt_int(total_o_to_d))
 kpi_card(k2, f"{c2} → {c1} applications", fmt_int(total_d_to_o))
-kpi_card(k3, f"YoY change ({c1}→{c2})", f"{yoy_o_to_d:+.1f}%" if yoy_o_to_d is not None else "—")
-kpi_card(k4, f"YoY change ({c2}→{c1})", f"{yoy_d_to_o:+.1f}%" if yoy_d_to_o is not None else "—")
+kpi_card(k3, f"YoY change ({c1}→{c2})", fmt_pct(yoy_o_to_d))
+kpi_card(k4, f"YoY change ({c2}→{c1})", fmt_pct(yoy_d_to_o))
 
 st.divider()
 
+# ------------------ Figures ------------------
+# Each builder is a pure function of (dataset key, filters, country pair), so the Figure object is
+# cached and reused across reruns. Builders return None when their slice has no rows.
+
+def codes_isin(col, values):
+    """`col.isin(values)` for a categorical column, evaluated on its integer codes as a numpy mask."""
+    cats = col.cat.categories
+    wanted = [cats.get_loc(v) for v in values if v in cats]
+    return np.isin(col.cat.codes.to_numpy(), wanted)
+
+def pair_rows(df, o, d):
+    return df[((df["origin_country"]==o)&(df["dest_country"]==d)) | ((df["origin_country"]==d)&(df["dest_country"]==o))]
+
+@st.cache_resource(max_entries=32)
+def build_line(df_key, ip_types, yr_from, yr_to, c1, c2):
+    flows_f = apply_filters(df_key, ip_types, yr_from, yr_to)
+    df_line = flows_f[codes_isin(flows_f["origin_country"], [c1,c2]) & codes_isin(flows_f["dest_country"], [c1,c2])]
+    # One point per (year, origin, ip_type) so the browser gets exactly what is drawn
+    df_line = df_line.groupby(["year","origin_country","ip_type"], as_index=False, observed=True)["applications"].sum()
+    fig = px.line(
+        df_line,
+        x="year",
+        y="applications",
+        color="ip_type",
+        line_group="origin_country",
+        facet_row="origin_country",
+        category_orders={"origin_country":[c1,c2]},
+        markers=True
+    )
+    fig.update_layout(height=400, margin=dict(l=10,r=10,b=10,t=30))
+    return fig
+
+@st.cache_resource(max_entries=32)
+def build_latest_bar(df_key, ip_types, yr_from, yr_to, c1, c2):
+    flows_f = apply_filters(df_key, ip_types, yr_from, yr_to)
+    latest_pair = pair_rows(flows_f[flows_f["year"]==yr_to], c1, c2)
+    if latest_pair.empty: return None
+    figb = px.bar(latest_pair, x="ip_type", y="applications", color="origin_country", barmode="group")
+    figb.update_layout(height=400, margin=dict(l=10,r=10,b=10,t=30))
+    return figb
+
+@st.cache_resource(max_entries=32)
+def build_sankey(df_key, ip_types, yr_from, yr_to, c1, c2):
+    df_sankey = pair_rows(apply_filters(df_key, ip_types, yr_from, yr_to), c1, c2)
+    if df_sankey.empty: return None
+    # One link per (origin, dest, ip_type) instead of one per year
+    df_sankey = df_sankey.groupby(["origin_country","dest_country","ip_type"], as_index=False, observed=True)["applications"].sum()
+    # Build basic Sankey: nodes are countries + ip types concatenated to show breakdown
+    nodes = list({c1, c2} | set(df_sankey["ip_type"].unique()))
+    node_index = pd.Series(range(len(nodes)), index=nodes)
+    links = {
+        # Unused categories would map to NaN and turn the indices into floats
+        "source": df_sankey["origin_country"].cat.remove_unused_categories().map(node_index).to_numpy().tolist(),
+        "target": df_sankey["dest_country"].cat.remove_unused_categories().map(node_index).to_numpy().tolist(),
+        "value": df_sankey["applications"].to_numpy(dtype=float).tolist(),
+        "label": (df_sankey["origin_country"].astype(str) + "→" + df_sankey["dest_country"].astype(str) + " (" + df_sankey["ip_type"].astype(str) + ")").tolist(),
+    }
+    sankey = go.Figure(data=[go.Sankey(
+        node=dict(label=nodes, pad=20, thickness=14),
+        link=dict(source=links["source"], target=links["target"], value=links["value"], label=links["label"])
+    )])
+    sankey.update_layout(height=450, margin=dict(l=10,r=10,b=10,t=30))
+    return sankey
+
+@st.cache_resource(max_entries=32)
+def build_pph(df_key, yr_from, yr_to, c1, c2):
+    pph_f = apply_filters(df_key, None, yr_from, yr_to)
+    if pph_f.empty: return None
+    df_pph = pph_f[pph_f["direction"].isin([f"{c1}→{c2}", f"{c2}→{c1}"])]
+    figp = px.bar(df_pph, x="year", y="requests", color="direction", barmode="group")
+    figp.update_layout(height=350, margin=dict(l=10,r=10,b=10,t=30))
+    return figp
+
+@st.cache_data(max_entries=32)
+def top_filers_pair(df_key, ip_types, yr_from, yr_to, c1, c2):
+    topfilers_f = apply_filters(df_key, ip_types, yr_from, yr_to)
+    df_top = topfilers_f[(topfilers_f["origin_country"]==c1) & (topfilers_f["dest_country"]==c2)]
+    if df_top.empty: return df_top
+    return df_top.sort_values("filings", ascending=False)
+
+@st.cache_resource(max_entries=32)
+def build_top_filers(df_key, ip_types, yr_from, yr_to, c1, c2, topn):
+    df_top = top_filers_pair(df_key, ip_types, yr_from, yr_to, c1, c2)
+    if df_top.empty: return None
+    df_topn = df_top.head(topn)
+    figt = px.bar(df_topn, x="filings", y="filer", color="ip_type", orientation="h")
+    figt.update_layout(height=480, margin=dict(l=10,r=10,b=10,t=30), yaxis={"categoryorder":"total ascending"})
+    return figt
+
+@st.cache_data(max_entries=32)
+def gender_derived(df_key, yr_from, yr_to, c1, c2):
+    gender_f = apply_filters(df_key, None, yr_from, yr_to)
+    df_g = gender_f[(gender_f["origin_country"]==c1) & (gender_f["dest_country"]==c2)]
+    if df_g.empty: return df_g
+    total = df_g[["female_inventors","male_inventors"]].sum(axis=1)
+    df_g = df_g.assign(total=total, female_share=(df_g["female_inventors"]/total).replace([np.inf, -np.inf], 0).fillna(0))
+    return df_g.sort_values("year")
+
+@st.cache_resource(max_entries=32)
+def build_gender_area(df_key, yr_from, yr_to, c1, c2):
+    df_g = gender_derived(df_key, yr_from, yr_to, c1, c2)
+    figg = px.area(df_g, x="year", y=["female_inventors","male_inventors"], labels={"value":"inventors","variable":"gender"})
+    figg.update_layout(height=380, margin=dict(l=10,r=10,b=10,t=30))
+    return figg
+
+@st.cache_data(max_entries=32)
+def jurisdiction_options(df_key, yr_from, yr_to):
+    importance_f = apply_filters(df_key, None, yr_from, yr_to)
+    if importance_f.empty: return []
+    return sorted(importance_f["jurisdiction"].dropna().unique().tolist())
+
+@st.cache_resource(max_entries=32)
+def build_importance(df_key, yr_from, yr_to, jurisdictions):
+    importance_f = apply_filters(df_key, None, yr_from, yr_to)
+    df_imp = importance_f[importance_f["jurisdiction"].isin(jurisdictions)]
+    df_imp = downsample_lines(df_imp, "year", "importance_score", "jurisdiction")
+    figi = px.line(df_imp, x="year", y="importance_score", color="jurisdiction", markers=True)
+    figi.update_layout(height=420, margin=dict(l=10,r=10,b=10,t=30))
+    return figi
+
 # ------------------ Layout Tabs ------------------
-t1, t2, t3, t4, t5 = st.tabs(["Overview", "Flows & PPH", "Top Filers", "Gender", "Annex"])
+# st.tabs renders every tab on each rerun; a tab-style radio lets us build only the section being viewed.
+# Widgets in hidden sections are not rendered and Streamlit drops their state, so section widgets mirror
+# their values into plain session_state entries that seed them when the section is shown again.
+TABS = ["Overview", "Flows & PPH", "Top Filers", "Gender", "Annex"]
+active_tab = st.radio("Section", TABS, horizontal=True, key="active_tab", label_visibility="collapsed")
 
-with t1:
+if active_tab == "Overview":
     col1, col2 = st.columns([0.62, 0.38])
     with col1:
         st.subheader("Applications over time")
-        df_line = flows_f[(flows_f["origin_country"].isin([c1,c2])) & (flows_f["dest_country"].isin([c1,c2]))]
-        if not selected_ip:
-            df_line = df_line.copy()
-        fig = px.line(
-            df_line,
-            x="year",
-            y="applications",
-            color="ip_type",
-            line_group="origin_country",
-            facet_row="origin_country",
-            category_orders={"origin_country":[c1,c2]},
-            markers=True
-        )
-        fig.update_layout(height=400, margin=dict(l=10,r=10,b=10,t=30))
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(build_line(flows_key, ip_filter, yr_from, yr_to, c1, c2), use_container_width=True)
     with col2:
         st.subheader("By IP type (latest year)")
-        latest = flows_f[flows_f["year"]==yr_to]
-        latest_pair = latest[((latest["origin_country"]==c1)&(latest["dest_country"]==c2)) | ((latest["origin_country"]==c2)&(latest["dest_country"]==c1))]
-        if latest_pair.empty:
+        figb = build_latest_bar(flows_key, ip_filter, yr_from, yr_to, c1, c2)
+        if figb is None:
             st.info("No rows for the selected year.")
         else:
-            figb = px.bar(latest_pair, x="ip_type", y="applications", color="origin_country", barmode="group")
-            figb.update_layout(height=400, margin=dict(l=10,r=10,b=10,t=30))
             st.plotly_chart(figb, use_container_width=True)
 
-with t2:
+if active_tab == "Flows & PPH":
     st.subheader("Origin → Destination flow (Sankey)")
-    df_sankey = flows_f[((flows_f["origin_country"]==c1)&(flows_f["dest_country"]==c2)) | ((flows_f["origin_country"]==c2)&(flows_f["dest_country"]==c1))]
-    if df_sankey.empty:
+    sankey = build_sankey(flows_key, ip_filter, yr_from, yr_to, c1, c2)
+    if sankey is None:
         st.info("No flow data for the chosen filters.")
     else:
-        # Build basic Sankey: nodes are countries + ip types concatenated to show breakdown
-        nodes = list({c1, c2} | set(df_sankey["ip_type"].unique()))
-        node_index = {n:i for i,n in enumerate(nodes)}
-        links = {"source":[], "target":[], "value":[], "label":[]}
-        for _, row in df_sankey.iterrows():
-            links["source"].append(node_index[row["origin_country"]])
-            links["target"].append(node_index[row["dest_country"]])
-            links["value"].append(float(row["applications"]))
-            links["label"].append(f'{row["origin_country"]}→{row["dest_country"]} ({row["ip_type"]})')
-        sankey = go.Figure(data=[go.Sankey(
-            node=dict(label=nodes, pad=20, thickness=14),
-            link=dict(source=links["source"], target=links["target"], value=links["value"], label=links["label"])
-        )])
-        sankey.update_layout(height=450, margin=dict(l=10,r=10,b=10,t=30))
         st.plotly_chart(sankey, use_container_width=True)
 
     st.subheader("PPH requests")
-    if pph_f.empty:
+    figp = build_pph(pph_key, yr_from, yr_to, c1, c2)
+    if figp is None:
         st.info("No PPH data.")
     else:
-        df_pph = pph_f[pph_f["direction"].isin([f"{c1}→{c2}", f"{c2}→{c1}"])]
-        figp = px.bar(df_pph, x="year", y="requests", color="direction", barmode="group")
-        figp.update_layout(height=350, margin=dict(l=10,r=10,b=10,t=30))
         st.plotly_chart(figp, use_container_width=True)
 
-with t3:
+if active_tab == "Top Filers":
     st.subheader("Top filers")
-    df_top = topfilers_f[(topfilers_f["origin_country"]==c1) & (topfilers_f["dest_country"]==c2)]
-    if df_top.empty:
+    df_top = top_filers_pair(topfilers_key, ip_filter, yr_from, yr_to, c1, c2)
+    topn = None
+    if not df_top.empty:
+        topn = st.slider("How many to show", min_value=5, max_value=20, value=st.session_state.get("top_filers_n", 10), step=1, key="top_filers_n_widget")
+        st.session_state["top_filers_n"] = topn
+    figt = build_top_filers(topfilers_key, ip_filter, yr_from, yr_to, c1, c2, topn)
+    if figt is None:
         st.info(f"No filers from {c1} to {c2} for the selected filters.")
     else:
-        topn = st.slider("How many to show", min_value=5, max_value=20, value=10, step=1)
-        df_topn = df_top.sort_values("filings", ascending=False).head(topn)
-        figt = px.bar(df_topn, x="filings", y="filer", color="ip_type", orientation="h")
-        figt.update_layout(height=480, margin=dict(l=10,r=10,b=10,t=30), yaxis={"categoryorder":"total ascending"})
         st.plotly_chart(figt, use_container_width=True)
 
-with t4:
+if active_tab == "Gender":
     st.subheader("Inventor gender split")
-    df_g = gender_f[(gender_f["origin_country"]==c1) & (gender_f["dest_country"]==c2)]
+    df_g = gender_derived(gender_key, yr_from, yr_to, c1, c2)
     if df_g.empty:
         st.info("No gender data for this pair.")
     else:
-        df_g = df_g.copy()
-        df_g["total"] = df_g["female_inventors"] + df_g["male_inventors"]
-        df_g["female_share"] = (df_g["female_inventors"]/df_g["total"]).replace([float('inf'), -float('inf')], 0).fillna(0)
         colg1, colg2 = st.columns([0.55, 0.45])
         with colg1:
-            figg = px.area(df_g, x="year", y=["female_inventors","male_inventors"], labels={"value":"inventors","variable":"gender"})
-            figg.update_layout(height=380, margin=dict(l=10,r=10,b=10,t=30))
-            st.plotly_chart(figg, use_container_width=True)
+            st.plotly_chart(build_gender_area(gender_key, yr_from, yr_to, c1, c2), use_container_width=True)
         with colg2:
             latest = df_g[df_g["year"]==df_g["year"].max()].tail(1)
             female_share = float(latest["female_share"].iloc[0])*100 if not latest.empty else None
             st.metric("Female share (latest year)", f"{female_share:.1f}%" if female_share is not None else "—")
-            st.dataframe(df_g.sort_values("year"), use_container_width=True, hide_index=True)
-
-with t5:
+            # Only the most recent rows are shipped to the browser, as Arrow-backed columns
+            df_table = df_g.tail(TABLE_MAX_ROWS).convert_dtypes(dtype_backend="pyarrow")
+            st.dataframe(df_table, use_container_width=True, hide_index=True,
+                         column_config={"female_share": st.column_config.NumberColumn(format="%.3f")})
+            if len(df_g) > TABLE_MAX_ROWS:
+                st.caption(f"Showing the latest {TABLE_MAX_ROWS:,} of {len(df_g):,} rows.")
+
+if active_tab == "Annex":
     st.subheader("Patent importance trend (by jurisdiction)")
-    if importance_f.empty:
+    jurisdictions = jurisdiction_options(importance_key, yr_from, yr_to)
+    if not jurisdictions:
         st.info("No importance data.")
     else:
-        selected_jurs = st.multiselect("Jurisdictions", sorted(importance_f["jurisdiction"].unique().tolist()), default=sorted(importance_f["jurisdiction"].unique().tolist())[:4])
-        df_imp = importance_f[importance_f["jurisdiction"].isin(selected_jurs)]
-        figi = px.line(df_imp, x="year", y="importance_score", color="jurisdiction", markers=True)
-        figi.update_layout(height=420, margin=dict(l=10,r=10,b=10,t=30))
-        st.plotly_chart(figi, use_container_width=True)
+        saved_jurs = [j for j in st.session_state.get("annex_jurisdictions", jurisdictions[:4]) if j in jurisdictions]
+        selected_jurs = st.multiselect("Jurisdictions", jurisdictions, default=saved_jurs, key="annex_jurisdictions_widget")
+        st.session_state["annex_jurisdictions"] = selected_jurs
+        st.plotly_chart(build_importance(importance_key, yr_from, yr_to, tuple(selected_jurs)), use_container_width=True)
 
 st.divider()
 